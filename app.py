@@ -1,137 +1,228 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 import streamlit as st
-import requests
-from bs4 import BeautifulSoup
-from fake_useragent import UserAgent
-from PIL import Image, ImageFilter, ImageEnhance
-from io import BytesIO
+import aiohttp
+import requests_cache
+from aiohttp_client_cache import CachedSession, SQLiteBackend
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from selectolax.parser import HTMLParser
+from processing import prepare_image
+import random
 import re
 import time
+from itertools import islice
+from datetime import timedelta
+from urllib.parse import urlsplit
 
 GOOGLE_IMAGE = "https://www.google.com/search?tbm=isch&"
+PAGE_INTERVAL = 1  # seconds between result page requests
+# Matched against the raw response bytes, so the page is never decoded as a whole
+_IMG_URL_RE = re.compile(rb'"(https?://[^"]+\.(?:jpe?g|png|webp))"')
+# Google's own thumbnail hosts; the originals are listed on the same page
+_THUMB_HOST_RE = re.compile(r"^https?://(?:encrypted-tbn|[^/]*gstatic\.com)")
 
-def get_image_urls(query, num_images=20):
-    """Fetch image URLs from Google Images with error collection."""
-    errors = []
-    if num_images < 1 or num_images > 100:
-        errors.append("Number of images must be between 1 and 100.")
-        return [], errors
+# On-disk HTTP caches so repeat queries are served from SQLite instead of the
+# network; point IMAGE_CACHE_DIR at a persistent volume to keep them across restarts
+CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", ".cache")
+CACHE_TTL = timedelta(hours=24)
+
+# One keep-alive connection pool for the whole app run
+SESSION = requests_cache.CachedSession(
+    os.path.join(CACHE_DIR, "pages"),
+    backend="sqlite",
+    expire_after=CACHE_TTL,
+    allowable_codes=(200,),
+    stale_if_error=True,
+    cache_control=True
+)
+_ADAPTER = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    max_retries=Retry(total=2, backoff_factor=0.2)
+)
+SESSION.mount("https://", _ADAPTER)
+SESSION.mount("http://", _ADAPTER)
+
+# Recent desktop browser User-Agents, rotated per scrape and per download batch
+_UAS = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36 Edg/128.0.0.0",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36 Edg/127.0.0.0",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36 Edg/128.0.0.0",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:130.0) Gecko/20100101 Firefox/130.0",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:129.0) Gecko/20100101 Firefox/129.0",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:128.0) Gecko/20100101 Firefox/128.0",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 14.6; rv:130.0) Gecko/20100101 Firefox/130.0",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 14.6; rv:129.0) Gecko/20100101 Firefox/129.0",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:130.0) Gecko/20100101 Firefox/130.0",
+    "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:129.0) Gecko/20100101 Firefox/129.0",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.6 Safari/605.1.15",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Safari/605.1.15",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4.1 Safari/605.1.15",
+)
+
+def _canon(url):
+    """Normalize a URL so CDN variants differing only in query string compare equal."""
+    # Only the host is lowercased; paths often carry case-sensitive IDs
+    parts = urlsplit(url)
+    return parts._replace(netloc=parts.netloc.lower(), query="", fragment="").geturl()
+
+def _iter_page_urls(body):
+    """Yield candidate image URLs from the raw bytes of a results page."""
+    # Extract from JSON structures; a scan of the whole body covers every script
+    for match in _IMG_URL_RE.finditer(body):
+        yield match.group(1).decode("utf-8", "replace").split("\\u003d", 1)[0]
     
-    ua = UserAgent()
-    image_urls = []
+    # Extract from img tags, only parsing the page if more URLs are still wanted
+    for img in HTMLParser(body).css("img"):
+        src = img.attributes.get("src") or img.attributes.get("data-src")
+        if src:
+            yield src.split("?")[0]
+
+def _iter_new_urls(body, found):
+    """Yield (canonical, url) pairs for new URLs; add each to found before pulling the next."""
+    for url in _iter_page_urls(body):
+        key = _canon(url)
+        if url.startswith("http") and key not in found and not _THUMB_HOST_RE.match(url):
+            yield key, url
+
+def _fetch_page(query, start, headers, not_before, cancelled):
+    """Fetch a results page as (sent_at, body) after not_before, or None if cancelled."""
+    if cancelled.wait(max(0, not_before - time.monotonic())):
+        return None
+    sent_at = time.monotonic()
+    search_url = f"{GOOGLE_IMAGE}q={query}&start={start}"
+    response = SESSION.get(search_url, headers=headers, timeout=15)
+    response.raise_for_status()
+    return sent_at, response.content
+
+@st.cache_data(ttl=3600, max_entries=128, show_spinner=False)
+def _scrape_image_urls(query, num_images):
+    """Scrape image URLs for a query, memoized per (query, num_images)."""
+    # Failures are raised rather than collected so they never end up in the cache
+    errors = []
+    image_urls = {}  # canonical URL -> first URL found for it, in ranking order
     start = 0
     headers = {
-        "User-Agent": ua.random,
+        "User-Agent": random.choice(_UAS),
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
         "Accept-Language": "en-US,en;q=0.5",
         "Referer": "https://www.google.com/",
         "DNT": "1",
     }
     
+    cancelled = threading.Event()
+    prefetcher = ThreadPoolExecutor(max_workers=1)
     try:
-        while len(image_urls) < num_images:
-            search_url = f"{GOOGLE_IMAGE}q={query}&start={start}"
-            response = requests.get(search_url, headers=headers, timeout=15)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, "html.parser")
+        page = prefetcher.submit(_fetch_page, query, start, headers, 0, cancelled)
+        while page is not None:
+            sent_at, body = page.result()
+            start += 20
+            
+            # Queue the next page before parsing this one; it goes out PAGE_INTERVAL
+            # after this page was requested, so parsing overlaps the wait
+            page = None
+            if start < 100:
+                page = prefetcher.submit(
+                    _fetch_page, query, start, headers, sent_at + PAGE_INTERVAL, cancelled
+                )
             
-            # Extract from JSON structures
-            scripts = soup.find_all("script")
-            image_pattern = re.compile(r'"https?://[^"]+\.(?:jpg|jpeg|png|webp)"')
-            for script in scripts:
-                matches = image_pattern.findall(script.text)
-                for url in matches:
-                    cleaned_url = url.strip('"').split("\\u003d")[0]
-                    if cleaned_url.startswith("http") and cleaned_url not in image_urls:
-                        image_urls.append(cleaned_url)
-                        if len(image_urls) >= num_images:
-                            break
-                if len(image_urls) >= num_images:
-                    break
-
-            # Extract from img tags
-            img_tags = soup.find_all("img")
-            for img in img_tags:
-                src = img.get("src") or img.get("data-src")
-                if src and src.startswith("http"):
-                    clean_src = src.split("?")[0]
-                    if clean_src not in image_urls:
-                        image_urls.append(clean_src)
-                        if len(image_urls) >= num_images:
-                            break
-                if len(image_urls) >= num_images:
-                    break
-
-            if not img_tags and not matches:
+            found_before = len(image_urls)
+            new_urls = _iter_new_urls(body, image_urls)
+            for key, url in islice(new_urls, num_images - found_before):
+                image_urls[key] = url
+            if len(image_urls) == found_before:
                 break
+            if len(image_urls) >= num_images:
+                break
+    finally:
+        # Drop a prefetch that is still waiting for its slot
+        cancelled.set()
+        prefetcher.shutdown(wait=False)
 
-            start += 20
-            time.sleep(1)  # Reduced sleep time for faster scraping
+    if not image_urls:
+        raise ValueError("no image URLs found on the results page")
+    if len(image_urls) < num_images:
+        errors.append(f"Found {len(image_urls)} images. Google may have limited results.")
 
-            if len(image_urls) < num_images and start >= 100:
-                errors.append(f"Found {len(image_urls)} images. Google may have limited results.")
-                break
+    return list(image_urls.values()), errors
 
-        return list(set(image_urls))[:num_images], errors
+def get_image_urls(query, num_images=20):
+    """Fetch image URLs from Google Images with error collection."""
+    errors = []
+    if num_images < 1 or num_images > 100:
+        errors.append("Number of images must be between 1 and 100.")
+        return [], errors
     
+    try:
+        return _scrape_image_urls(query, num_images)
     except Exception as e:
         errors.append(f"Error fetching images: {str(e)}")
         return [], errors
 
-def process_image(url, target_size=None, enhance=True):
-    """Professional-grade image processing with conditional resizing"""
+async def _fetch(session, url):
+    """Download a single image, returning its bytes or an error message."""
     try:
-        headers = {"User-Agent": UserAgent().random}
-        response = requests.get(url, headers=headers, timeout=15)
-        response.raise_for_status()
-        
-        img = Image.open(BytesIO(response.content)).convert("RGB")
-        original_size = img.size  # Store original dimensions
-        
-        # Conditional resizing only when target_size is provided
-        if target_size:
-            target_width, target_height = target_size
-            orig_width, orig_height = img.size
-            target_aspect = target_width / target_height
-            orig_aspect = orig_width / orig_height
-
-            # Advanced resizing with aspect ratio preservation
-            if orig_aspect > target_aspect:
-                new_height = target_height
-                new_width = int(orig_width * (target_height / orig_height))
-                img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                left = (new_width - target_width) // 2
-                img = img.crop((left, 0, left + target_width, target_height))
-            else:
-                new_width = target_width
-                new_height = int(orig_height * (target_width / orig_width))
-                img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                top = (new_height - target_height) // 2
-                img = img.crop((0, top, target_width, top + target_height))
-
-        # Professional image enhancement pipeline
-        if enhance:
-            # Advanced sharpening with dynamic parameters
-            img = img.filter(ImageFilter.UnsharpMask(
-                radius=2.5, 
-                percent=200, 
-                threshold=3
-            ))
-            
-            # Contrast enhancement
-            contrast_enhancer = ImageEnhance.Contrast(img)
-            img = contrast_enhancer.enhance(1.2)
-            
-            # Color balancing
-            color_enhancer = ImageEnhance.Color(img)
-            img = color_enhancer.enhance(1.1)
-            
-            # Edge enhancement
-            edge_enhancer = ImageEnhance.Sharpness(img)
-            img = edge_enhancer.enhance(1.15)
-
-        return img, original_size, None  # Return original size for reference
+        async with session.get(url) as response:
+            response.raise_for_status()
+            return await response.read(), None
     except Exception as e:
-        return None, None, f"Failed to process {url}: {str(e)}"
+        return None, f"Failed to download {url}: {str(e)}"
+
+async def fetch_all(urls):
+    """Download all image URLs concurrently, serving repeats from the disk cache."""
+    connector = aiohttp.TCPConnector(
+        limit=64,
+        limit_per_host=8,
+        ttl_dns_cache=300,
+        enable_cleanup_closed=True
+    )
+    cache = SQLiteBackend(
+        os.path.join(CACHE_DIR, "images"),
+        expire_after=CACHE_TTL,
+        allowed_codes=(200,),
+        cache_control=True
+    )
+    headers = {"User-Agent": random.choice(_UAS)}
+    timeout = aiohttp.ClientTimeout(total=15)
+    async with CachedSession(cache=cache, connector=connector, headers=headers, timeout=timeout) as session:
+        return await asyncio.gather(*(_fetch(session, url) for url in urls))
+
+@st.cache_resource
+def get_process_pool():
+    """Worker processes for the image pipeline, shared by every session."""
+    # "spawn" avoids forking the multithreaded server; workers re-run this
+    # script once in bare mode, which only executes the module setup
+    return ProcessPoolExecutor(
+        max_workers=os.cpu_count(),
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
+def submit_images(jobs, target_size, enhance, optimize):
+    """Queue every (url, data) job on the shared pool, returning {future: index}."""
+    for attempt in range(2):
+        executor = get_process_pool()
+        try:
+            return {
+                executor.submit(prepare_image, url, data, target_size, enhance, optimize): idx
+                for idx, (url, data) in enumerate(jobs)
+            }
+        except BrokenProcessPool:
+            # A worker died while the pool sat idle; retry once with a fresh pool
+            get_process_pool.clear()
+            if attempt:
+                raise
 
 # Streamlit UI Configuration
 st.set_page_config(page_title="Pro Image Scraper", layout="wide")
@@ -147,6 +238,8 @@ with st.sidebar:
                                help="Select desired output aspect ratio")
         enhance = st.checkbox("Enable Professional Enhancement", True,
                             help="Apply advanced image optimization techniques")
+        optimize = st.checkbox("Smallest File Size", False,
+                               help="Progressive, optimized JPEG encoding for about 10% smaller downloads (slower)")
         
     with st.expander("Scraping Settings", expanded=True):
         num_images = st.slider("Number of Images", 1, 100, 20,
@@ -178,52 +271,74 @@ if st.button("🚀 Start Scraping & Processing"):
         st.error("❌ No images found. Try a different query.")
         st.stop()
     
-    processed_images = []
-    original_sizes = []
-    progress_bar = st.progress(0)
-    status_text = st.empty()
+    with st.spinner("⬇️ Downloading images..."):
+        downloads = asyncio.run(fetch_all(urls))
     
-    for i, url in enumerate(urls):
-        status_text.markdown(f"🔧 Processing image {i+1}/{len(urls)}...")
-        img, original_size, error = process_image(url, target_size, enhance)
-        if img:
-            processed_images.append(img)
-            original_sizes.append(original_size)
+    jobs = []
+    for url, (data, error) in zip(urls, downloads):
         if error:
             all_errors.append(error)
-        progress_bar.progress((i+1)/len(urls))
+        else:
+            jobs.append((url, data))
     
+    progress_bar = st.progress(0)
+    status_text = st.empty()
     st.markdown("---")
-    if processed_images:
-        success_rate = len(processed_images)/len(urls)*100
-        st.success(f"✅ Successfully processed {len(processed_images)}/{len(urls)} images ({success_rate:.1f}% success rate)")
-        
-        # Image grid with metadata
-        cols_per_row = 3
-        cols = st.columns(cols_per_row)
+    summary = st.empty()
+    
+    # One placeholder per image, in ranking order, so cells can be filled as they finish
+    cols_per_row = 3
+    cols = st.columns(cols_per_row)
+    cells = [cols[idx % cols_per_row].empty() for idx in range(len(jobs))]
+    
+    # Downloads are done, so the pool only runs the CPU-bound image work
+    processed_count = 0
+    try:
+        futures = submit_images(jobs, target_size, enhance, optimize)
+    except BrokenProcessPool:
+        futures = {}
+        all_errors.append("Image processing workers could not be started; no images were processed.")
+    for done, future in enumerate(as_completed(futures), start=1):
+        idx = futures[future]
+        try:
+            processed_size, orig_size, jpeg_bytes, preview, error = future.result()
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory); replace the pool for the next run
+            get_process_pool.clear()
+            all_errors.append("Image processing workers crashed; the remaining images were skipped.")
+            break
+        status_text.markdown(f"🔧 Processed image {done}/{len(jobs)}...")
+        progress_bar.progress(done/len(jobs))
+        if error:
+            all_errors.append(error)
+        if processed_size is None:
+            continue
+        processed_count += 1
         
-        for idx, (img, orig_size) in enumerate(zip(processed_images, original_sizes)):
-            with cols[idx % cols_per_row]:
-                # Display resolution information
-                if target_size:
-                    res_info = f"Processed: {img.size[0]}x{img.size[1]}"
-                else:
-                    res_info = f"Original: {orig_size[0]}x{orig_size[1]}"
-                
-                st.image(img, use_column_width=True, caption=res_info)
-                
-                # Download functionality
-                img_bytes = BytesIO()
-                img.save(img_bytes, format="JPEG", quality=90, optimize=True)
-                st.download_button(
-                    label=f"⬇️ Download Image {idx+1}",
-                    data=img_bytes.getvalue(),
-                    file_name=f"{query.replace(' ', '_')}_{idx+1}.jpg",
-                    mime="image/jpeg",
-                    key=f"download_{idx}"
-                )
+        with cells[idx].container():
+            # Display resolution information
+            if target_size:
+                res_info = f"Processed: {processed_size[0]}x{processed_size[1]}"
+            else:
+                res_info = f"Original: {orig_size[0]}x{orig_size[1]}"
+            
+            # Already a JPEG narrower than the content width, so Streamlit serves it as-is
+            st.image(preview, use_column_width=True, caption=res_info, output_format="JPEG")
+            
+            # Download functionality
+            st.download_button(
+                label=f"⬇️ Download Image {idx+1}",
+                data=jpeg_bytes,
+                file_name=f"{query.replace(' ', '_')}_{idx+1}.jpg",
+                mime="image/jpeg",
+                key=f"download_{idx}"
+            )
+    
+    if processed_count:
+        success_rate = processed_count/len(urls)*100
+        summary.success(f"✅ Successfully processed {processed_count}/{len(urls)} images ({success_rate:.1f}% success rate)")
     else:
-        st.error("❌ Failed to process any images. Check settings and try again.")
+        summary.error("❌ Failed to process any images. Check settings and try again.")
     
     # Error reporting system
     if all_errors:
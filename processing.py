@@ -0,0 +1,176 @@
+import logging
+import multiprocessing
+import cv2
+import numpy as np
+import PIL
+from PIL import Image
+from io import BytesIO
+
+PREVIEW_WIDTH = 640  # about one gallery column in the wide layout
+
+logger = logging.getLogger(__name__)
+# Pillow-SIMD builds carry a ".postN" suffix, so the version tells which build is loaded.
+# Warn once from the main process; nothing configures logging, so lower levels are dropped
+if ".post" not in PIL.__version__ and multiprocessing.current_process().name == "MainProcess":
+    logger.warning("Pillow-SIMD is not loaded (stock Pillow %s)", PIL.__version__)
+
+# Parallelism comes from the process pool, so keep OpenCV single-threaded per worker
+cv2.setNumThreads(1)
+
+# ITU-R 601-2 luma weights, as used by PIL's convert("L")
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+# PIL's ImageFilter.SMOOTH kernel, the reference image for ImageEnhance.Sharpness
+_SMOOTH = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13
+_BAND_ROWS = 256  # rows per float32 band in enhance_pixels
+
+# libjpeg-turbo is a system library, so fall back to PIL decoding without it
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    _TJ = TurboJPEG()
+except (ImportError, RuntimeError, OSError):
+    _TJ = None
+
+def decode_image(data, target_size=None):
+    """Decode image bytes to an RGB array, returning it and the original size."""
+    if _TJ is not None and data[:3] == b"\xff\xd8\xff":
+        try:
+            width, height, _, _ = _TJ.decode_header(data)
+            # Same decompression-bomb limit Image.open enforces on the PIL path
+            max_pixels = Image.MAX_IMAGE_PIXELS
+            if max_pixels and width * height > 2 * max_pixels:
+                raise Image.DecompressionBombError(
+                    f"Image size ({width * height} pixels) exceeds limit of {2 * max_pixels} pixels"
+                )
+            # Shrink by 1/2, 1/4 or 1/8 during decoding while still covering target_size
+            scale = (1, 1)
+            if target_size:
+                target_width, target_height = target_size
+                for num, denom in sorted(_TJ.scaling_factors, key=lambda f: f[0] / f[1]):
+                    if (num < denom and width * num // denom >= target_width
+                            and height * num // denom >= target_height):
+                        scale = (num, denom)
+                        break
+            pixels = _TJ.decode(data, pixel_format=TJPF_RGB, scaling_factor=scale)
+            return pixels, (width, height)
+        except OSError:
+            pass  # e.g. CMYK JPEGs, which PIL can still convert
+    
+    img = Image.open(BytesIO(data))
+    original_size = img.size
+    if target_size:
+        # Same DCT-scaled decode through PIL's libjpeg; a no-op for other formats
+        img.draft("RGB", target_size)
+    return np.asarray(img.convert("RGB")), original_size
+
+def unsharp_mask(pixels, radius=2.5, percent=200, threshold=3):
+    """ImageFilter.UnsharpMask for an RGB array, using only saturating uint8 OpenCV ops."""
+    blurred = cv2.GaussianBlur(pixels, (0, 0), radius)
+    amount = percent / 100
+    sharpened = cv2.addWeighted(pixels, 1 + amount, blurred, -amount, 0)
+    # Pixels within threshold of the blur are left as-is
+    keep = cv2.compare(cv2.absdiff(pixels, blurred), threshold, cv2.CMP_LT)
+    return cv2.copyTo(pixels, keep, sharpened)
+
+def enhance_pixels(pixels, contrast=1.2, color=1.1, sharpness=1.15):
+    """ImageEnhance Contrast, Color and Sharpness for an RGB array in one fused pass."""
+    mean = round(float(cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY).mean()))
+    out = np.empty_like(pixels)
+    height = pixels.shape[0]
+    # Row bands (plus a 1-row halo for the 3x3 smooth) keep the float32
+    # temporaries a few MB instead of several times the image size
+    for top in range(0, height, _BAND_ROWS):
+        bottom = min(top + _BAND_ROWS, height)
+        lo, hi = max(top - 1, 0), min(bottom + 1, height)
+        img = pixels[lo:hi].astype(np.float32)
+        luma = img @ _LUMA
+        # Contrast and Color are linear blends, folded into one affine transform:
+        # mean + contrast * (luma - mean) + contrast * color * (img - luma)
+        luma *= contrast * (1 - color)
+        luma += mean * (1 - contrast)
+        img *= contrast * color
+        img += luma[..., None]
+        smooth = cv2.filter2D(img, -1, _SMOOTH, borderType=cv2.BORDER_REPLICATE)
+        cv2.addWeighted(img, sharpness, smooth, 1 - sharpness, 0, dst=img)
+        np.clip(img, 0, 255, out=img)
+        out[top:bottom] = img[top - lo:bottom - lo]
+    return out
+
+def process_bytes(url, data, target_size=None, enhance=True):
+    """Professional-grade image processing with conditional resizing"""
+    try:
+        pixels, original_size = decode_image(data, target_size)
+        
+        # Conditional resizing only when target_size is provided
+        if target_size:
+            target_width, target_height = target_size
+            orig_height, orig_width = pixels.shape[:2]
+            target_aspect = target_width / target_height
+            orig_aspect = orig_width / orig_height
+
+            # Advanced resizing with aspect ratio preservation
+            if orig_aspect > target_aspect:
+                new_height = target_height
+                new_width = round(orig_width * (target_height / orig_height))
+            else:
+                new_width = target_width
+                new_height = round(orig_height * (target_width / orig_width))
+            # Area averaging is the faster and alias-free choice for shrinking;
+            # LANCZOS4 is kept for enlarging small sources
+            interpolation = cv2.INTER_AREA if new_width < orig_width else cv2.INTER_LANCZOS4
+            pixels = cv2.resize(pixels, (new_width, new_height), interpolation=interpolation)
+            
+            # Center crop is a plain array slice, no pixel copy
+            left = (new_width - target_width) // 2
+            top = (new_height - target_height) // 2
+            pixels = pixels[top:top + target_height, left:left + target_width]
+
+        # Professional image enhancement pipeline
+        if enhance:
+            # Cheap measurements skip the steps an already crisp, punchy image doesn't need
+            gray = cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY)
+            is_sharp = cv2.Laplacian(gray, cv2.CV_32F).var() > 500
+            contrast = 1.0 if gray.std() > 60 else 1.2
+            saturation = cv2.cvtColor(pixels, cv2.COLOR_RGB2HSV)[..., 1].mean()
+            color = 1.0 if saturation > 100 else 1.1
+            sharpness = 1.0 if is_sharp else 1.15
+
+            # Advanced sharpening with dynamic parameters
+            if not is_sharp:
+                pixels = unsharp_mask(pixels, radius=2.5, percent=200, threshold=3)
+            # Contrast, color and edge enhancement fused into one pass
+            if (contrast, color, sharpness) != (1.0, 1.0, 1.0):
+                pixels = enhance_pixels(pixels, contrast=contrast, color=color, sharpness=sharpness)
+
+        return pixels, original_size, None  # Return original size for reference
+    except Exception as e:
+        return None, None, f"Failed to process {url}: {str(e)}"
+
+def image_to_bytes(pixels, quality=90, optimize=False):
+    """Encode a processed RGB array as 4:2:0 JPEG, progressive and optimized if requested."""
+    _, buffer = cv2.imencode(
+        ".jpg",
+        cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR),
+        [cv2.IMWRITE_JPEG_QUALITY, quality,
+         cv2.IMWRITE_JPEG_SAMPLING_FACTOR, cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420,
+         cv2.IMWRITE_JPEG_OPTIMIZE, int(optimize),
+         cv2.IMWRITE_JPEG_PROGRESSIVE, int(optimize)]
+    )
+    return buffer.tobytes()
+
+def make_preview(pixels):
+    """Shrink a processed image to a small JPEG for the gallery grid."""
+    height, width = pixels.shape[:2]
+    if width > PREVIEW_WIDTH:
+        preview_size = (PREVIEW_WIDTH, round(height * PREVIEW_WIDTH / width))
+        # Previews don't need LANCZOS quality; area averaging is cheaper and alias-free
+        pixels = cv2.resize(pixels, preview_size, interpolation=cv2.INTER_AREA)
+    return image_to_bytes(pixels, quality=70)
+
+def prepare_image(url, data, target_size=None, enhance=True, optimize=False):
+    """Process downloaded bytes into download and preview JPEGs in a worker process."""
+    # Sizes and encoded bytes are far cheaper to send back than pixel arrays
+    pixels, original_size, error = process_bytes(url, data, target_size, enhance)
+    if pixels is None:
+        return None, None, None, None, error
+    processed_size = (pixels.shape[1], pixels.shape[0])
+    return processed_size, original_size, image_to_bytes(pixels, optimize=optimize), make_preview(pixels), error